@@ -1,15 +1,16 @@
 import sys
 from config import TARGET_SITES
 from scraper import VapeScraper
-from attribute_extractor import LLMProcessor
+from attribute_extractor import get_llm_processor
 import pandas as pd
 
 def main():
+    site_names = tuple(TARGET_SITES)
     print("Available sites:")
-    for i, site in enumerate(TARGET_SITES.keys()):
+    for i, site in enumerate(site_names):
         print(f"{i+1}. {site}")
     site_idx = int(input("Select a site by number: ")) - 1
-    site_name = list(TARGET_SITES.keys())[site_idx]
+    site_name = site_names[site_idx]
 
     num_urls = int(input("How many product URLs to find? "))
 
@@ -24,7 +25,7 @@ def main():
     products = scraper.scrape_urls(urls[:no_to_scrape], site_name)
     print(f"Scraped {len(products)} products.")
     print("Running LLM processor...")
-    llm = LLMProcessor(batch_size=4)
+    llm = get_llm_processor(batch_size=4)
     structured = llm.process_products(products)
     df = llm.save_structured_data(structured)
 
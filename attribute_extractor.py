@@ -1,55 +1,225 @@
 import os
 import json
+import csv
+import asyncio
+import hashlib
+import sqlite3
 import pandas as pd
-from typing import List, Dict, Callable
+from typing import List, Dict, Callable, Optional, Sequence, Tuple
 import time
-from openai import OpenAI, AzureOpenAI
+import httpx
+from openai import (
+    OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI,
+    RateLimitError, APIConnectionError, InternalServerError
+)
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
 from datetime import datetime
-from functools import wraps
+from functools import wraps, lru_cache, partial
 
-def retry_on_error(max_retries: int = 3, delay: float = 1.0):
-    """Decorator for retrying operations on error."""
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+REQUIRED_FIELDS = [
+    "brand", "model", "flavor", "puff_count",
+    "nicotine_strength", "battery_capacity", "coil_type"
+]
+
+# Output budget for one extracted product; batched calls scale it by batch length.
+MAX_TOKENS_PER_PRODUCT = 160
+
+# Number of LLM requests allowed in flight at once.
+MAX_CONCURRENT_REQUESTS = 8
+
+# Limits applied to product content before it is sent to the LLM.
+MAX_RAW_TEXT_CHARS = 1500
+MAX_CONTENT_TOKENS = 2000
+
+# Local store of LLM results keyed by a hash of the prompt and product content.
+CACHE_PATH = "output/.llm_cache.sqlite"
+
+# Connection pool shared by every request made through one OpenAI client.
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+
+SYSTEM_PROMPT = """You are a precise data extraction assistant that extracts specific attributes from product information. Always respond with valid JSON.
+
+You will receive the scraped text of one or more vape products. Each product starts with a header line of the form "### Product <idx>", where <idx> is a zero-based integer, followed by the raw page text (URL, title, meta description, body text and specification tables).
+
+For every product, extract the following attributes:
+- Brand: the manufacturer or brand name (e.g. "Geek Bar", "Raz", "SMOK").
+- Model/Type: the product model or product type (e.g. "Pulse", "DC25000", "Disposable Vape Kit").
+- Flavor: the flavor name. If several flavors are offered, list them separated by ", ".
+- Puff Count: the advertised number of puffs, digits only with no separators (e.g. "15000").
+- Nicotine Strength: the nicotine strength including its unit (e.g. "5%", "50mg", "3mg/mL").
+- Battery Capacity: the battery capacity including its unit (e.g. "650mAh").
+- Coil Type: the coil or heating element description (e.g. "Dual Mesh Coil", "0.8ohm Mesh").
+
+Formatting rules:
+- Return ONLY a JSON object, no other text, no markdown fences.
+- The object has a single key "results" whose value is an array with exactly one entry per product.
+- Each entry contains the integer "idx" of the product it describes plus the keys "brand", "model", "flavor", "puff_count", "nicotine_strength", "battery_capacity" and "coil_type".
+- Every value other than "idx" is a string.
+- If an attribute cannot be found, use "N/A" as the value. Never guess values that are not supported by the text.
+- Ignore navigation menus, footers, reviews, shipping notices and related-product listings.
+- Products that are not vapes (accessories, edibles, rolling papers) still get an entry; use "N/A" for attributes that do not apply.
+
+Example input:
+### Product 0
+URL: https://example.com/products/geek-bar-pulse
+
+Raw Text Content:
+Title: Geek Bar Pulse 15000 Puffs Disposable Vape | Example Store
+Meta Description: Shop the Geek Bar Pulse disposable with 15000 puffs.
+Geek Bar Pulse Disposable
+Flavor: Watermelon Ice
+Specifications: Puffs15000Nicotine5% (50mg)Battery650mAh RechargeableCoilDual Mesh Coil
+
+### Product 1
+URL: https://example.com/products/raz-dc25000-vape
+
+Raw Text Content:
+Title: RAZ DC25000 Disposable | Example Store
+RAZ DC25000 Rechargeable Disposable Vape
+Up to 25,000 puffs in regular mode
+Available flavors: Blue Razz Ice, Strawberry Kiwi, Miami Mint
+Nicotine: 5%
+Specifications: Battery Capacity650mAhE-Liquid Capacity16mL
+
+### Product 2
+URL: https://example.com/products/fire-bar-smell-proof-max-duffle-bag
+
+Raw Text Content:
+Title: Fire Bar Smell Proof Max Duffle Bag | Example Store
+Fire Bar Smell Proof Max Duffle Bag
+Carbon-lined odor blocking duffle bag with combination lock.
+
+### Product 3
+URL: https://example.com/7daze-clickmates-5-prefilled-mates-max-2-pack
+
+Raw Text Content:
+Title: 7Daze Clickmates 5 Prefilled Mates Max 2-Pack
+7Daze Clickmates Prefilled Pods, 2 Pack
+Flavor: Mango Peach
+Nicotine Strength: 50mg
+Coil: 0.8ohm Mesh Coil
+Specifications: Capacity5mL per podPuffs5000 per pod
+
+### Product 4
+URL: https://example.com/kumi-six-disposable-vape
+
+Raw Text Content:
+Title: Kumi Six Disposable Vape 6000 Puffs
+Meta Description: Kumi Six disposable vape by Kumi, 6000 puffs, 3% nicotine.
+Kumi Six Disposable
+Choose your flavor: Pink Lemonade
+Specifications: Puff Count6,000Nicotine Strength3%Battery500mAhCoil TypeMesh Coil
+Customer Reviews: Great flavor, lasted two weeks!
+Free shipping on orders over $50
+
+Example output:
+{"results": [
+{"idx": 0, "brand": "Geek Bar", "model": "Pulse", "flavor": "Watermelon Ice", "puff_count": "15000", "nicotine_strength": "5%", "battery_capacity": "650mAh", "coil_type": "Dual Mesh Coil"},
+{"idx": 1, "brand": "RAZ", "model": "DC25000", "flavor": "Blue Razz Ice, Strawberry Kiwi, Miami Mint", "puff_count": "25000", "nicotine_strength": "5%", "battery_capacity": "650mAh", "coil_type": "N/A"},
+{"idx": 2, "brand": "Fire Bar", "model": "Smell Proof Max Duffle Bag", "flavor": "N/A", "puff_count": "N/A", "nicotine_strength": "N/A", "battery_capacity": "N/A", "coil_type": "N/A"},
+{"idx": 3, "brand": "7Daze", "model": "Clickmates Prefilled Pods", "flavor": "Mango Peach", "puff_count": "5000", "nicotine_strength": "50mg", "battery_capacity": "N/A", "coil_type": "0.8ohm Mesh Coil"},
+{"idx": 4, "brand": "Kumi", "model": "Six", "flavor": "Pink Lemonade", "puff_count": "6000", "nicotine_strength": "3%", "battery_capacity": "500mAh", "coil_type": "Mesh Coil"}
+]}"""
+
+def retry_on_error(max_retries: int = 3, initial_delay: float = 0.5, max_delay: float = 8.0,
+                   exceptions: Tuple = (Exception,)):
+    """Decorator for retrying operations on error with exponential backoff and jitter.
+    
+    Only the given exception types are retried; the wrapped call returns None
+    once retries are exhausted or another error is raised. Works for both
+    regular functions and coroutines.
+    """
     def decorator(func: Callable):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
+        retrying = retry(
+            stop=stop_after_attempt(max_retries),
+            wait=wait_exponential_jitter(initial=initial_delay, max=max_delay),
+            retry=retry_if_exception_type(exceptions),
+            reraise=True
+        )(func)
+        
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
                 try:
-                    return func(*args, **kwargs)
+                    return await retrying(*args, **kwargs)
                 except Exception as e:
-                    if attempt == max_retries - 1:
-                        print(f"Error in {func.__name__}: {str(e)}")
-                        return None
-                    time.sleep(delay)
-            return None
+                    print(f"Error in {func.__name__}: {str(e)}")
+                    return None
+            return async_wrapper
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return retrying(*args, **kwargs)
+            except Exception as e:
+                print(f"Error in {func.__name__}: {str(e)}")
+                return None
         return wrapper
     return decorator
 
-class LLMProcessor:
-    _instance = None
-    _client = None
-    _initialized = False
+class ResultCache:
+    """SQLite-backed cache of extracted attributes keyed by content hash."""
+    
+    def __init__(self, path: str = CACHE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT)"
+        )
+        self._conn.commit()
+        
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached result for key, or None on a miss."""
+        row = self._conn.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
     
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(LLMProcessor, cls).__new__(cls)
-        return cls._instance
+    def set(self, key: str, result: Dict):
+        """Store the result for key, replacing any previous entry."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO results (key, result) VALUES (?, ?)",
+            (key, json.dumps(result))
+        )
+        self._conn.commit()
+
+class LLMProcessor:
+    _SYSTEM_PROMPT = SYSTEM_PROMPT
     
     def __init__(self, batch_size=4):
-        if not self._initialized:
-            self.batch_size = batch_size
-            self._initialize_client()
-            self._initialized = True
+        self.batch_size = batch_size
+        self._streamed_products = None
+        self._encoding = None
+        self._output_dir_ready = False
+        self._ensure_output_directory()
+        self._cache = ResultCache()
+        self._initialize_client()
             
     def _ensure_output_directory(self):
         """Create output directory if it doesn't exist."""
-        output_dir = "output"
-        if not os.path.exists(output_dir):
-            print(f"Creating output directory: {output_dir}")
-            os.makedirs(output_dir)
-            print("Output directory created successfully")
+        if self._output_dir_ready:
+            return
+        os.makedirs("output", exist_ok=True)
+        self._output_dir_ready = True
             
+    @staticmethod
+    def _new_async_client(client_cls, **kwargs):
+        """Create an async client with its own pooled httpx transport.
+        
+        Async clients are bound to the event loop they run on, so one is
+        created per process_products run rather than kept on the instance.
+        """
+        return client_cls(http_client=httpx.AsyncClient(limits=HTTP_LIMITS), max_retries=0, **kwargs)
+    
     def _initialize_client(self):
-        """Initialize OpenAI or Azure OpenAI client."""
+        """Initialize OpenAI or Azure OpenAI client.
+        
+        SDK retries are disabled (max_retries=0) on every client so that
+        retry_on_error is the only retry layer for LLM calls.
+        """
         try:
             azure_api_key = os.getenv("AZURE_OPENAI_API_KEY")
             azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -58,6 +228,15 @@ class LLMProcessor:
             if all([azure_api_key, azure_endpoint, azure_deployment]):
                 print("Initializing Azure OpenAI client...")
                 self._client = AzureOpenAI(
+                    api_key=azure_api_key,
+                    api_version="2024-02-15-preview",
+                    azure_endpoint=azure_endpoint,
+                    http_client=httpx.Client(limits=HTTP_LIMITS),
+                    max_retries=0
+                )
+                self._async_client_factory = partial(
+                    self._new_async_client,
+                    AsyncAzureOpenAI,
                     api_key=azure_api_key,
                     api_version="2024-02-15-preview",
                     azure_endpoint=azure_endpoint
@@ -69,7 +248,16 @@ class LLMProcessor:
             openai_api_key = os.getenv("OPENAI_API_KEY")
             if openai_api_key:
                 print("Initializing OpenAI client...")
-                self._client = OpenAI(api_key=openai_api_key)
+                self._client = OpenAI(
+                    api_key=openai_api_key,
+                    http_client=httpx.Client(limits=HTTP_LIMITS),
+                    max_retries=0
+                )
+                self._async_client_factory = partial(
+                    self._new_async_client,
+                    AsyncOpenAI,
+                    api_key=openai_api_key
+                )
                 self._deployment = "gpt-4-turbo-preview"  
                 print("OpenAI client initialized successfully")
                 return
@@ -80,17 +268,13 @@ class LLMProcessor:
             print(f"Warning: OpenAI client initialization failed: {str(e)}")
             print("LLM-based attribute extraction will be disabled")
             self._client = None
+            self._async_client_factory = None
             self._deployment = None
             
-    @retry_on_error(max_retries=3)
-    def _process_with_model(self, prompt: str) -> str:
-        """Process a prompt using OpenAI or Azure OpenAI."""
-        if not self._client:
-            print("LLM client not initialized. Skipping processing.")
-            return None
-            
+    def _build_request(self, prompt: str, max_tokens: int) -> Dict:
+        """Build chat completion arguments for a prompt."""
         messages = [
-            {"role": "system", "content": "You are a precise data extraction assistant that extracts specific attributes from product information. Always respond with valid JSON."},
+            {"role": "system", "content": self._SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ]
         
@@ -98,17 +282,19 @@ class LLMProcessor:
         print(json.dumps(messages, indent=2))
         print("===============\n")
         
-        response = self._client.chat.completions.create(
-            model=self._deployment,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500,
-            top_p=0.9,
-            frequency_penalty=0.1,
-            presence_penalty=0.1,
-            response_format={ "type": "json_object" }  
-        )
-        
+        return {
+            "model": self._deployment,
+            "messages": messages,
+            "temperature": 0,
+            "max_tokens": max_tokens,
+            "top_p": 1,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+            "response_format": { "type": "json_object" }
+        }
+    
+    def _read_response(self, response) -> str:
+        """Extract the generated text from a chat completion."""
         generated_text = response.choices[0].message.content
         
         print("\n=== LLM Output ===")
@@ -116,57 +302,246 @@ class LLMProcessor:
         print("================\n")
         
         return generated_text
+    
+    @retry_on_error(max_retries=3, exceptions=(RateLimitError, APIConnectionError, InternalServerError))
+    async def _aprocess_with_model(self, aclient, prompt: str, max_tokens: int = MAX_TOKENS_PER_PRODUCT) -> str:
+        """Process a prompt asynchronously using OpenAI or Azure OpenAI."""
+        if not aclient:
+            print("LLM client not initialized. Skipping processing.")
+            return None
+        
+        response = await aclient.chat.completions.create(**self._build_request(prompt, max_tokens))
+        return self._read_response(response)
             
-    @retry_on_error(max_retries=3)
-    def _process_single_product(self, product: Dict) -> Dict:
-        """Process a single product using LLM."""
-        prompt = f"""Extract the following attributes from this vape product information:
-        - Brand
-        - Model/Type
-        - Flavor
-        - Puff Count
-        - Nicotine Strength
-        - Battery Capacity
-        - Coil Type
-        
-        Product Information:
-        {product['content']}
-        
-        Return ONLY a JSON object with the following structure, no other text:
-        {{
-            "brand": "extracted brand",
-            "model": "extracted model/type",
-            "flavor": "extracted flavor",
-            "puff_count": "extracted puff count",
-            "nicotine_strength": "extracted nicotine strength",
-            "battery_capacity": "extracted battery capacity",
-            "coil_type": "extracted coil type"
-        }}
-        
-        If an attribute cannot be found, use "N/A" as the value.
+    def _prepare_content(self, content: str) -> str:
+        """Trim product content down to what the LLM needs.
+        
+        Consecutive duplicate lines are dropped. Within the "Raw Text Content"
+        section every "Specifications:" line is kept, since spec tables hold
+        most of the extracted attributes, and only the body text is capped at
+        MAX_RAW_TEXT_CHARS characters.
         """
+        lines = []
+        for line in content.splitlines():
+            if not lines or line != lines[-1]:
+                lines.append(line)
+        content = "\n".join(lines)
+        
+        marker = "Raw Text Content:"
+        head, sep, raw_text = content.partition(marker)
+        if not sep or len(raw_text) <= MAX_RAW_TEXT_CHARS:
+            return content
         
-        response = self._process_with_model(prompt)
-        if response:
+        body_lines = []
+        spec_lines = []
+        budget = MAX_RAW_TEXT_CHARS
+        for line in raw_text.splitlines():
+            if line.startswith("Specifications:"):
+                spec_lines.append(line)
+            elif budget > 0:
+                body_lines.append(line[:budget])
+                budget -= len(line) + 1
+        return head + sep + "\n".join(body_lines + spec_lines)
+    
+    def _get_encoding(self):
+        """Return the tiktoken encoding for the deployment, if available.
+        
+        Returns None when tiktoken is missing or its encoding cannot be loaded
+        (e.g. the one-time BPE download fails), disabling token truncation.
+        """
+        if tiktoken is None or self._encoding is False:
+            return None
+        if self._encoding is None:
             try:
-                result = json.loads(response)
-                
-                required_fields = [
-                    "brand", "model", "flavor", "puff_count",
-                    "nicotine_strength", "battery_capacity", "coil_type"
-                ]
-                
-                if all(field in result for field in required_fields):
-                    return result
-                else:
-                    print(f"Missing required fields in response for {product['file_name']}")
-                    return self._get_default_attributes()
-                    
-            except json.JSONDecodeError as e:
-                print(f"Error parsing LLM response for {product['file_name']}: {str(e)}")
-                return self._get_default_attributes()
-        
-        return self._get_default_attributes()
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self._deployment or "")
+                except KeyError:
+                    self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"Warning: tiktoken encoding unavailable, skipping token truncation: {str(e)}")
+                self._encoding = False
+                return None
+        return self._encoding
+    
+    def _prepare_contents(self, products: List[Dict]) -> List[str]:
+        """Truncate already prepared product content by tokens in one batch.
+        
+        Content over MAX_CONTENT_TOKENS is cut from the middle so the page
+        header and the trailing specifications both survive.
+        """
+        contents = [product['content'] for product in products]
+        
+        encoding = self._get_encoding()
+        if encoding is None:
+            return contents
+        
+        half = MAX_CONTENT_TOKENS // 2
+        prepared = []
+        for content, tokens in zip(contents, encoding.encode_batch(contents)):
+            if len(tokens) > MAX_CONTENT_TOKENS:
+                content = encoding.decode(tokens[:half]) + "\n...\n" + encoding.decode(tokens[-half:])
+            prepared.append(content)
+        return prepared
+    
+    def _cache_key(self, content: str) -> str:
+        """Hash prepared content together with the prompt and model in use."""
+        normalized = " ".join(content.split())
+        key = hashlib.blake2b(digest_size=16)
+        key.update(self._SYSTEM_PROMPT.encode())
+        key.update(b"\0" + (self._deployment or "").encode() + b"\0")
+        key.update(normalized.encode())
+        return key.hexdigest()
+    
+    def _build_batch_prompt(self, products: List[Dict]) -> str:
+        """Build the user message enumerating products by index.
+        
+        All instructions live in the system prompt so that the request prefix
+        stays identical across calls and is served from the prompt cache.
+        """
+        sections = []
+        for idx, content in enumerate(self._prepare_contents(products)):
+            sections.append(f"### Product {idx}\n{content}")
+        return "\n\n".join(sections)
+    
+    def _parse_batch_response(self, response: str, products: List[Dict]) -> List[Dict]:
+        """Map a batched JSON response back onto products by index."""
+        results = [self._get_default_attributes() for _ in products]
+        if not response:
+            return results
+        
+        try:
+            entries = json.loads(response).get('results', [])
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"Error parsing batched LLM response: {str(e)}")
+            return results
+        
+        for entry in entries:
+            idx = entry.get('idx') if isinstance(entry, dict) else None
+            if not isinstance(idx, int) or not 0 <= idx < len(products):
+                continue
+            if all(field in entry for field in REQUIRED_FIELDS):
+                results[idx] = {field: entry[field] for field in REQUIRED_FIELDS}
+            else:
+                print(f"Missing required fields in response for {products[idx]['file_name']}")
+        
+        return results
+    
+    async def _aprocess_batch(self, aclient, products: List[Dict]) -> List[Dict]:
+        """Process several products with a single asynchronous LLM request."""
+        response = await self._aprocess_with_model(
+            aclient,
+            self._build_batch_prompt(products),
+            max_tokens=MAX_TOKENS_PER_PRODUCT * len(products)
+        )
+        return self._parse_batch_response(response, products)
+    
+    async def _run_batches(self, batches: List[Tuple[List[int], List[Dict]]], results: List[Dict],
+                           writer: csv.DictWriter = None, write_order: Sequence[int] = ()):
+        """Run batches concurrently, bounded by MAX_CONCURRENT_REQUESTS.
+        
+        Each batch is paired with the positions its products occupy in the
+        pre-sized results list, so output order matches input order regardless
+        of completion order. When a writer is given, the rows at write_order
+        are streamed in that order as soon as every earlier row is available.
+        Successful extractions are added to the cache.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        next_row = 0
+        
+        def flush():
+            nonlocal next_row
+            while next_row < len(write_order) and results[write_order[next_row]] is not None:
+                writer.writerow(results[write_order[next_row]])
+                next_row += 1
+        
+        async def run(aclient, positions: List[int], batch: List[Dict]):
+            async with semaphore:
+                batch_results = await self._aprocess_batch(aclient, batch)
+            self._store_results(positions, batch, batch_results, results)
+            if writer:
+                flush()
+        
+        # Rows already filled from the cache before the first fresh result.
+        if writer:
+            flush()
+        
+        if not self._async_client_factory:
+            await asyncio.gather(*[run(None, positions, batch) for positions, batch in batches])
+            return
+        
+        async with self._async_client_factory() as aclient:
+            await asyncio.gather(*[run(aclient, positions, batch) for positions, batch in batches])
+    
+    def process_products_batch_api(self, products: List[Dict], poll_interval: float = 30.0) -> List[Dict]:
+        """Process products offline through the OpenAI Batch API.
+        
+        Products are normalized, cached and batched exactly as in
+        process_products; only cache misses are submitted.
+        """
+        items = self._normalize_products(products)
+        structured_products = [None] * len(items)
+        batches = self._batch_uncached(items, structured_products)
+        if not batches:
+            return structured_products
+        
+        if not self._client:
+            print("LLM client not initialized. Skipping processing.")
+            for positions, batch in batches:
+                self._store_results(positions, batch, [self._get_default_attributes() for _ in batch], structured_products)
+            return structured_products
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        input_path = f"output/batch_input_{timestamp}.jsonl"
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for batch_idx, (_, batch) in enumerate(batches):
+                request = {
+                    "custom_id": str(batch_idx),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self._deployment,
+                        "messages": [
+                            {"role": "system", "content": self._SYSTEM_PROMPT},
+                            {"role": "user", "content": self._build_batch_prompt(batch)}
+                        ],
+                        "temperature": 0,
+                        "max_tokens": MAX_TOKENS_PER_PRODUCT * len(batch),
+                        "response_format": {"type": "json_object"}
+                    }
+                }
+                f.write(json.dumps(request) + "\n")
+        
+        with open(input_path, 'rb') as f:
+            input_file = self._client.files.create(file=f, purpose="batch")
+        batch_job = self._client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        print(f"Submitted batch job: {batch_job.id}")
+        
+        while batch_job.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            batch_job = self._client.batches.retrieve(batch_job.id)
+        
+        responses = {}
+        if batch_job.status == "completed" and batch_job.output_file_id:
+            output_text = self._client.files.content(batch_job.output_file_id).text
+            for line in output_text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                body = (record.get('response') or {}).get('body') or {}
+                choices = body.get('choices') or []
+                if choices:
+                    responses[record['custom_id']] = choices[0]['message']['content']
+        else:
+            print(f"Batch job {batch_job.id} finished with status: {batch_job.status}")
+        
+        for batch_idx, (positions, batch) in enumerate(batches):
+            batch_results = self._parse_batch_response(responses.get(str(batch_idx)), batch)
+            self._store_results(positions, batch, batch_results, structured_products)
+        return structured_products
             
     def _get_default_attributes(self) -> Dict:
         """Return default attributes when processing fails."""
@@ -180,10 +555,13 @@ class LLMProcessor:
             "coil_type": "N/A"
         }
         
-    def process_products(self, products: List[Dict]) -> List[Dict]:
-        """Process products in batches using LLM."""
-        structured_products = []
+    def _normalize_products(self, products: List[Dict]) -> List[Dict]:
+        """Group products by site and build the items sent to the LLM.
         
+        Each item carries file_name, its content (falling back to the
+        product's scraped fields when there is no 'content') already passed
+        through _prepare_content, and its cache_key.
+        """
         products_by_site = {}
         for product in products:
             site = product.get('site')
@@ -200,13 +578,12 @@ class LLMProcessor:
                 products_by_site[site] = []
             products_by_site[site].append(product)
         
+        items = []
         for site, site_products in products_by_site.items():
-            site_dir = f"output/{site}"
-            if not os.path.exists(site_dir):
-                print(f"Warning: No text files found for site {site}")
-                for product in site_products:
-                    try:
-                        content = f"""URL: {product.get('url', 'N/A')}
+            for product in site_products:
+                content = product.get('content')
+                if content is None:
+                    content = f"""URL: {product.get('url', 'N/A')}
 
 Title: {product.get('title', 'N/A')}
 
@@ -220,55 +597,107 @@ Specifications:
 Raw Text Content:
 {product.get('raw_text', 'N/A')}"""
 
-                        structured_product = self._process_single_product({
-                            'file_name': f"{product.get('slug', 'unknown')}.txt",
-                            'content': content
-                        })
-                        structured_products.append(structured_product)
-                    except Exception as e:
-                        print(f"Error processing product: {str(e)}")
-                        structured_products.append(self._get_default_attributes())
+                content = self._prepare_content(content)
+                items.append({
+                    'site': site,
+                    'file_name': product.get('file_name') or f"{product.get('slug', 'unknown')}.txt",
+                    'content': content,
+                    'cache_key': self._cache_key(content)
+                })
+        return items
+    
+    def _batch_uncached(self, items: List[Dict], results: List[Dict]) -> List[Tuple[List[int], List[Dict]]]:
+        """Fill cached results in place and batch the remaining items per site.
+        
+        Items sharing a cache_key are sent once; the extra positions are kept
+        on the batched item under 'duplicate_positions'. Returns (positions,
+        items) pairs, where positions index into results.
+        """
+        batches = []
+        site_positions = {}
+        pending = {}
+        for position, item in enumerate(items):
+            key = item['cache_key']
+            if key in pending:
+                pending[key]['duplicate_positions'].append(position)
                 continue
-                
-            text_files = [f for f in os.listdir(site_dir) if f.endswith('.txt')]
-            
-            for i in range(0, len(text_files), self.batch_size):
-                batch_files = text_files[i:i + self.batch_size]
-                batch_products = []
-                
-                for file_name in batch_files:
-                    file_path = os.path.join(site_dir, file_name)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            batch_products.append({
-                                'file_name': file_name,
-                                'content': content
-                            })
-                    except Exception as e:
-                        print(f"Error reading file {file_name}: {str(e)}")
-                
-                if batch_products:
-                    for product in batch_products:
-                        structured_product = self._process_single_product(product)
-                        structured_products.append(structured_product)
-                
-                time.sleep(1)
+            cached = self._cache.get(key)
+            if cached is not None:
+                results[position] = cached
+            else:
+                pending[key] = dict(item, duplicate_positions=[])
+                site_positions.setdefault(item['site'], []).append(position)
+        
+        for positions in site_positions.values():
+            for i in range(0, len(positions), self.batch_size):
+                chunk = positions[i:i + self.batch_size]
+                batches.append((chunk, [pending[items[position]['cache_key']] for position in chunk]))
+        return batches
+    
+    def _store_results(self, positions: List[int], batch: List[Dict], batch_results: List[Dict], results: List[Dict]):
+        """Place batch results at their positions and cache successful ones."""
+        default_attributes = self._get_default_attributes()
+        for position, item, result in zip(positions, batch, batch_results):
+            results[position] = result
+            for duplicate in item.get('duplicate_positions', ()):
+                results[duplicate] = dict(result)
+            if result != default_attributes:
+                self._cache.set(item['cache_key'], result)
+    
+    def process_products(self, products: List[Dict]) -> List[Dict]:
+        """Process products in batches using LLM."""
+        items = self._normalize_products(products)
+        if not items:
+            return []
+        
+        structured_products = [None] * len(items)
+        batches = self._batch_uncached(items, structured_products)
+        
+        cached_count = sum(result is not None for result in structured_products)
+        if cached_count:
+            print(f"Reusing cached results for {cached_count} products")
+        
+        output_path = self._new_output_path()
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=REQUIRED_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            asyncio.run(self._run_batches(batches, structured_products, writer, range(len(items))))
+        
+        self._streamed_products = structured_products
+        print(f"Saved structured data to: {output_path}")
         
         return structured_products
     
+    def _new_output_path(self) -> str:
+        """Return a timestamped path for a structured products CSV."""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = f"output/structured_products_{timestamp}.csv"
+        suffix = 1
+        while os.path.exists(output_path):
+            output_path = f"output/structured_products_{timestamp}_{suffix}.csv"
+            suffix += 1
+        return output_path
+    
     def save_structured_data(self, structured_products: List[Dict]) -> pd.DataFrame:
-        """Save structured data to CSV and return DataFrame."""
+        """Save structured data to CSV and return DataFrame.
+        
+        The list returned by the latest process_products run has already been
+        streamed to CSV, so it is not written a second time.
+        """
         if not structured_products:
             return pd.DataFrame()
-            
-        self._ensure_output_directory()
-            
-        df = pd.DataFrame(structured_products)
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_path = f"output/structured_products_{timestamp}.csv"
-        df.to_csv(output_path, index=False)
-        print(f"Saved structured data to: {output_path}")
+        df = pd.DataFrame(structured_products, columns=REQUIRED_FIELDS)
+        
+        if structured_products is not self._streamed_products:
+            output_path = self._new_output_path()
+            df.to_csv(output_path, index=False)
+            print(f"Saved structured data to: {output_path}")
         
-        return df 
\ No newline at end of file
+        return df
+
+
+@lru_cache(maxsize=None)
+def get_llm_processor(batch_size: int = 4) -> LLMProcessor:
+    """Return a shared LLMProcessor for the given batch size."""
+    return LLMProcessor(batch_size)
@@ -1,5 +1,10 @@
 import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
 from bs4 import BeautifulSoup
+from bs4.dammit import EncodingDetector
+import lxml.html
+from lxml import etree
 from urllib.parse import urljoin, urlparse
 import time
 from dotenv import load_dotenv
@@ -13,21 +18,93 @@ from tqdm import tqdm
 
 load_dotenv()
 
+
+class TransientHTTPError(requests.HTTPError):
+    """Raised on retryable HTTP statuses, carrying Retry-After if given."""
+
+    def __init__(self, *args, retry_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(TransientHTTPError):
+    """Raised on HTTP 429."""
+
+
+_backoff = wait_exponential_jitter(initial=0.5, max=8)
+
+
+def _wait_retry_after(retry_state):
+    """Honour Retry-After when given, otherwise back off exponentially with jitter."""
+    retry_after = getattr(retry_state.outcome.exception(), 'retry_after', None)
+    if retry_after is not None:
+        return retry_after
+    return _backoff(retry_state)
+
+
 class VapeScraper:
-    def __init__(self):
+    # Single document-order pass collecting every element _extract_raw_text needs.
+    _page_xpath = etree.XPath(
+        "//title | //meta[@name='description'] | //main | //article"
+        " | //div[contains(@class, 'content') or contains(@class, 'main') or contains(@class, 'product')]"
+        " | //table | //dl"
+    )
+    _main_text_xpath = etree.XPath(
+        ".//p | .//h1 | .//h2 | .//h3 | .//h4 | .//h5 | .//h6 | .//li | .//td | .//th"
+    )
+
+    def __init__(self, request_interval=1.0, request_burst=5):
+        """Create a scraper.
+        
+        Product-page requests are throttled per host by a token bucket:
+        request_burst requests may start back to back, after which tokens
+        refill at one per request_interval seconds. The sustained rate is
+        therefore 1 / request_interval requests per second per site (1 rps by
+        default), and that rate, not the worker pool size, bounds scrape_urls
+        throughput; the workers mainly overlap network latency.
+        """
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
         self.products = []
         self.visited_urls = set()
         self.base_domain = None
+        self._base_prefixes = ()
         self.product_urls = set()
         self.found_urls_lock = threading.Lock()
+        self.rate_limit_lock = threading.Lock()
+        self.next_request_time = {}
+        self.request_interval = request_interval
+        self.request_burst = max(1, request_burst)
+        self._cat_re = re.compile(r'product|collection|category|shop', re.IGNORECASE)
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # Retries are handled by tenacity in _fetch, so the adapter does not retry.
+        adapter = HTTPAdapter(
+            pool_connections=20,
+            pool_maxsize=50,
+            max_retries=0
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
         self.target_sites = TARGET_SITES
 
+    def _set_base_url(self, site_name):
+        """Point the scraper at a site and cache its URL prefixes."""
+        self.base_url = self.target_sites[site_name]['base_url']
+        self.base_domain = urlparse(self.base_url).netloc
+        self._base_prefixes = ('https://' + self.base_domain, 'http://' + self.base_domain)
+
     def is_valid_url(self, url):
         """Check if URL is valid and belongs to the same domain."""
+        for prefix in self._base_prefixes:
+            if url.startswith(prefix):
+                # Guard against hosts that merely start with the base domain.
+                return url[len(prefix):len(prefix) + 1] in ('', '/', '?', '#')
+        if url.startswith(('http://', 'https://')):
+            return False
         try:
             parsed = urlparse(url)
             return parsed.netloc == self.base_domain if parsed.netloc else False
@@ -39,39 +116,83 @@ class VapeScraper:
         pattern = self.target_sites[site_name]['product_pattern']
         return pattern in url
 
-    def get_page(self, url):
-        """Get page content with retry mechanism."""
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, headers=self.headers, timeout=5)
-                response.raise_for_status()
-                return response.text
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    print(f"Error fetching {url}: {str(e)}")
-                    return None
-                time.sleep(0.5)
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=_wait_retry_after,
+        retry=retry_if_exception_type((requests.ConnectionError, requests.Timeout, TransientHTTPError)),
+        reraise=True
+    )
+    def _fetch(self, url, throttle=False):
+        """Fetch a URL, retrying transient failures, 5xx responses and rate limits.
+        
+        With throttle set, every attempt (including retries) waits for the
+        host's rate limiter, and a 429 pushes the host's schedule back by its
+        Retry-After delay so other workers hold off too.
+        """
+        if throttle:
+            self._wait_for_host(url)
+        response = self.session.get(url, timeout=5)
+        if response.status_code == 429 or response.status_code >= 500:
+            header = response.headers.get('Retry-After', '')
+            retry_after = min(float(header), 60.0) if header.isdigit() else None
+            if response.status_code == 429:
+                if throttle and retry_after:
+                    self._defer_host(url, retry_after)
+                raise RateLimitedError(
+                    f"429 Too Many Requests for url: {url}",
+                    response=response,
+                    retry_after=retry_after
+                )
+            raise TransientHTTPError(
+                f"{response.status_code} Server Error for url: {url}",
+                response=response,
+                retry_after=retry_after
+            )
+        response.raise_for_status()
+        return response.content, self._header_charset(response)
+
+    def _header_charset(self, response):
+        """Return the charset declared in the Content-Type header, if any."""
+        for param in response.headers.get('Content-Type', '').split(';')[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'charset':
+                return value.strip('"\' ') or None
+        return None
+
+    def get_page(self, url, throttle=False):
+        """Get raw page bytes and the header charset with retry mechanism.
+        
+        Bytes are returned undecoded together with the Content-Type charset so
+        the parsers can decode them without requests guessing from the body.
+        Returns (None, None) on failure.
+        """
+        try:
+            return self._fetch(url, throttle=throttle)
+        except Exception as e:
+            print(f"Error fetching {url}: {str(e)}")
+            return None, None
 
     def process_page(self, url, site_name):
         """Process a single page and extract links."""
-        if url in self.visited_urls:
-            return set(), set()
-        
         with self.found_urls_lock:
+            if url in self.visited_urls:
+                return set(), set()
             self.visited_urls.add(url)
         
-        html = self.get_page(url)
+        html, charset = self.get_page(url)
         if not html:
             return set(), set()
         
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = BeautifulSoup(html, 'lxml', from_encoding=charset)
         product_links = set()
         category_links = set()
+        base_url = self.base_url
         
         for a in soup.find_all('a', href=True):
             href = a['href']
-            full_url = urljoin(self.base_url, href)
+            if href.startswith(('#', 'mailto:', 'tel:', 'javascript:')):
+                continue
+            full_url = urljoin(base_url, href)
             
             if not self.is_valid_url(full_url):
                 continue
@@ -79,16 +200,14 @@ class VapeScraper:
             if self.is_product_url(full_url, site_name):
                 product_links.add(full_url)
             elif full_url not in self.visited_urls:
-                if any(term in full_url.lower() for term in ['product', 'collection', 'category', 'shop']):
+                if self._cat_re.search(full_url):
                     category_links.add(full_url)
         
         return product_links, category_links
 
     def find_product_urls(self, site_name, max_urls=100):
         """Find product URLs for a given site using parallel processing."""
-        site_info = self.target_sites[site_name]
-        self.base_url = site_info['base_url']
-        self.base_domain = urlparse(self.base_url).netloc
+        self._set_base_url(site_name)
         
         
         self.visited_urls = set()
@@ -141,74 +260,135 @@ class VapeScraper:
         }
         return product
 
-    def scrape_urls(self, urls, site_name):
-        """Scrape a list of specific URLs."""
+    def _wait_for_host(self, url):
+        """Block until the host's token bucket allows another request.
+        
+        next_request_time holds each host's theoretical arrival time; a
+        request may start up to request_burst - 1 intervals ahead of it.
+        """
+        host = urlparse(url).netloc
+        burst_window = (self.request_burst - 1) * self.request_interval
+        with self.rate_limit_lock:
+            now = time.monotonic()
+            arrival = max(now, self.next_request_time.get(host, now))
+            start = max(now, arrival - burst_window)
+            self.next_request_time[host] = arrival + self.request_interval
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def _defer_host(self, url, delay):
+        """Hold off new requests to the URL's host for at least delay seconds."""
+        host = urlparse(url).netloc
+        burst_window = (self.request_burst - 1) * self.request_interval
+        with self.rate_limit_lock:
+            now = time.monotonic()
+            self.next_request_time[host] = max(
+                self.next_request_time.get(host, now),
+                now + delay + burst_window
+            )
+
+    def _scrape_single_url(self, url, site_name, site_dir=None):
+        """Fetch and parse a single product page, optionally saving its text."""
+        html, charset = self.get_page(url, throttle=True)
+        if not html:
+            return None
+
+        # libxml2 falls back to Latin-1 when a page has no <meta charset>, so
+        # take the header charset, then the declared one, then assume UTF-8.
+        encoding = charset or EncodingDetector.find_declared_encoding(html, is_html=True) or 'utf-8'
+        doc = lxml.html.fromstring(html, parser=lxml.html.HTMLParser(encoding=encoding))
+        product_info = self.extract_slug(url)
+
+        product_info['site'] = site_name
+
+        raw_text = self._extract_raw_text(doc)
+
+        product_slug = product_info['slug'].replace('/', '_')
+        product_info['file_name'] = f"{product_slug}.txt"
+        product_info['content'] = f"URL: {url}\n\n\nRaw Text Content:\n{raw_text}"
+
+        if site_dir:
+            with open(f"{site_dir}/{product_info['file_name']}", 'w', encoding='utf-8') as f:
+                f.write(product_info['content'])
+
+        return product_info
+
+    def scrape_urls(self, urls, site_name, max_workers=10, save_text=True):
+        """Scrape a list of specific URLs concurrently.
+        
+        Returned products carry their extracted text under 'content'; the
+        per-product .txt files are only written as an audit trail when
+        save_text is set.
+        """
         if not urls:
             return []
         
-        site_info = self.target_sites[site_name]
-        self.base_url = site_info['base_url']
-        self.base_domain = urlparse(self.base_url).netloc
+        self._set_base_url(site_name)
         
-        site_dir = f"output/{site_name}"
-        os.makedirs(site_dir, exist_ok=True)
+        site_dir = None
+        if save_text:
+            site_dir = f"output/{site_name}"
+            os.makedirs(site_dir, exist_ok=True)
         
         
-        products = []
-        for i, url in tqdm(enumerate(urls, 1)):
-            
-            html = self.get_page(url)
-            if html:
-                soup = BeautifulSoup(html, 'html.parser')
-                product_info = self.extract_slug(url)
-                
-                product_info['site'] = site_name
-                
-                raw_text = self._extract_raw_text(soup)
-                
-                product_slug = product_info['slug'].replace('/', '_')
-                product_file = f"{site_dir}/{product_slug}.txt"
-                with open(product_file, 'w', encoding='utf-8') as f:
-                    f.write(f"URL: {url}\n\n")
-                    f.write("\nRaw Text Content:\n")
-                    f.write(raw_text)
-                
-                products.append(product_info)
-                
+        products = [None] * len(urls)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_position = {
+                executor.submit(self._scrape_single_url, url, site_name, site_dir): position
+                for position, url in enumerate(urls)
+            }
             
-            time.sleep(1)
+            for future in tqdm(as_completed(future_to_position), total=len(future_to_position)):
+                position = future_to_position[future]
+                try:
+                    products[position] = future.result()
+                except Exception as e:
+                    print(f"Error scraping {urls[position]}: {str(e)}")
         
-        return products
+        return [product for product in products if product]
 
 
-    def _extract_raw_text(self, soup: BeautifulSoup) -> str:
+    def _element_text(self, element) -> str:
+        """Return the stripped text of an element, like get_text(strip=True)."""
+        return "".join(text.strip() for text in element.itertext())
+
+    def _extract_raw_text(self, doc: lxml.html.HtmlElement) -> str:
         """Extract all text content from the page, preserving structure."""
-        for script in soup(["script", "style"]):
-            script.decompose()
+        etree.strip_elements(doc, etree.Comment, 'script', 'style', with_tail=False)
             
         text_parts = []
         
-        title = soup.find('title')
-        if title:
-            text_parts.append(f"Title: {title.get_text(strip=True)}")
+        title = meta_desc = None
+        main_candidates = {'main': None, 'article': None, 'div': None}
+        specs = []
+        for element in self._page_xpath(doc):
+            tag = element.tag
+            if tag in ('table', 'dl'):
+                specs.append(element)
+            elif tag == 'title':
+                title = title if title is not None else element
+            elif tag == 'meta':
+                meta_desc = meta_desc if meta_desc is not None else element
+            elif main_candidates[tag] is None:
+                main_candidates[tag] = element
+        
+        if title is not None:
+            text_parts.append(f"Title: {self._element_text(title)}")
             
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
-        if meta_desc:
+        if meta_desc is not None:
             text_parts.append(f"Meta Description: {meta_desc.get('content', '')}")
             
-        main_content = soup.find('main') or soup.find('article') or soup.find('div', class_=re.compile(r'content|main|product'))
-        if main_content:
-            for element in main_content.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'td', 'th']):
-                text = element.get_text(strip=True)
+        main_content = next((el for el in main_candidates.values() if el is not None), None)
+        if main_content is not None:
+            for element in self._main_text_xpath(main_content):
+                text = self._element_text(element)
                 if text:
                     text_parts.append(text)
                     
-        specs = soup.find_all(['table', 'dl'])
         for spec in specs:
-            text = spec.get_text(strip=True)
+            text = self._element_text(spec)
             if text:
                 text_parts.append(f"Specifications: {text}")
                 
         return "\n".join(text_parts)
-        
-        
\ No newline at end of file